@@ -15,6 +15,7 @@ import argparse
 import os
 import re
 import sys
+from pathlib import Path
 
 
 # Bootstrap 5.3.3 CDN with SRI integrity hashes
@@ -72,6 +73,37 @@ SKIP_NAV_LINK = (
     'Skip to main content</a>'
 )
 
+# Replacement markup assembled once at import rather than per file.
+# Inline CSS and dark mode JS follow the Bootstrap CDN link;
+# dark mode JS must be in <head> to apply before first paint.
+_HEAD_INJECT = BOOTSTRAP_CSS_CDN + '\n  ' + INLINE_CSS + '\n  ' + DARK_MODE_JS
+_BODY_INJECT = '<body>\n' + SKIP_NAV_LINK
+_VIEWPORT_META = '\n  <meta name="viewport" content="width=device-width, initial-scale=1">'
+_TABLE_CAPTION = '<table class="table">\n<caption>Requirements traceability matrix</caption>\n<thead>'
+
+# Sidecar marker written next to each HTML file once it has been post-processed
+STAMP_SUFFIX = '.pp.stamp'
+
+# Precompiled patterns used by process_html() and the extract_* helpers.
+# Each starts with a literal prefix the regex engine can scan for quickly.
+# Markup this module already produced (CDN URLs, main-content id, skip-nav
+# link) is not matched again, so re-processing a page leaves it unchanged.
+_RE_HTML_TAG = re.compile(r'<html\b[^>]*>')
+_RE_BOOTSTRAP_CSS = re.compile(r'<link[^>]*href="(?!https?://)[^"]*bootstrap\.min\.css"[^>]*/?>')
+_RE_GENERAL_CSS = re.compile(r'<link[^>]*href="[^"]*general\.css"[^>]*/?>[\r\n]*')
+_RE_DOORSTOP_CSS = re.compile(r'<link[^>]*href="[^"]*doorstop\.css"[^>]*/?>[\r\n]*')
+_RE_MATHJAX_SCRIPT = re.compile(r'<script[^>]*id="MathJax-script"[^>]*></script>[\r\n]*')
+_RE_MATHJAX_CONFIG = re.compile(r'<script type="text/x-mathjax-config">.*?</script>[\r\n]*', re.DOTALL)
+_RE_BODY = re.compile('<body>(?!' + re.escape('\n' + SKIP_NAV_LINK) + ')')
+_RE_MAIN = re.compile(r'<main\b(?![^>]*\bid="main-content")([^>]*)>')
+_RE_TABLE_CAPTION = re.compile(r'<table class="table">\s*<thead>')
+_RE_BOOTSTRAP_JS = re.compile(r'<script[^>]*src="(?!https?://)[^"]*bootstrap\.bundle\.min\.js"[^>]*></script>')
+_RE_CONTENTS_DROPDOWN = re.compile(
+    r'<a class="nav-link dropdown-toggle"[^>]*>\s*Contents\s*</a>\s*<ul class="dropdown-menu">(.*?)</ul>\s*</li>',
+    re.DOTALL
+)
+_RE_TITLE = re.compile(r'<title>(.*?)</title>')
+
 
 def compute_nav_prefix(html):
     """Determine the relative path prefix for navigation links.
@@ -84,6 +116,21 @@ def compute_nav_prefix(html):
     return ''
 
 
+def compute_page_kind(relpath):
+    """Determine which Doorstop page a file is: 'index', 'traceability' or 'doc'.
+
+    relpath is the file's path relative to the output directory. Only the
+    index.html and traceability.html at the output root are the index and
+    traceability pages; everything else, including documents/index.html for
+    a document prefixed "index", is a document.
+    """
+    if relpath == 'index.html':
+        return 'index'
+    if relpath == 'traceability.html':
+        return 'traceability'
+    return 'doc'
+
+
 def build_navbar(title, nav_prefix, has_contents_dropdown, contents_html, project_name=""):
     """Build the project-branded navbar HTML."""
     # Brand text
@@ -134,12 +181,14 @@ def build_navbar(title, nav_prefix, has_contents_dropdown, contents_html, projec
 
 def extract_contents_dropdown(html):
     """Extract the Contents dropdown menu items from the original navbar."""
+    # Anchor on the literal first so the regex only runs from the toggle onwards
+    i = html.find('Contents')
+    if i == -1:
+        return None
+    start = html.rfind('<a class="nav-link dropdown-toggle"', 0, i)
+
     # Look for the Contents dropdown UL content
-    m = re.search(
-        r'<a class="nav-link dropdown-toggle"[^>]*>\s*Contents\s*</a>\s*<ul class="dropdown-menu">(.*?)</ul>\s*</li>',
-        html,
-        re.DOTALL
-    )
+    m = _RE_CONTENTS_DROPDOWN.search(html, start if start != -1 else i)
     if m:
         return m.group(1).strip()
     return None
@@ -147,21 +196,30 @@ def extract_contents_dropdown(html):
 
 def extract_title(html):
     """Extract the page title from <title> tag."""
-    m = re.search(r'<title>(.*?)</title>', html)
+    m = _RE_TITLE.search(html)
     if m:
         return m.group(1)
     return 'Document'
 
 
-def process_html(filepath, project_name=""):
-    """Process a single HTML file."""
-    with open(filepath, 'r', encoding='utf-8') as f:
-        html = f.read()
+# Stands in for the Contents <ul> body in the precomputed navbar template
+_CONTENTS_PLACEHOLDER = '{{CONTENTS}}'
+
+
+def _make_context(nav_prefix, project_name=""):
+    """Precompute the navbars and headings for one nav_prefix.
 
-    nav_prefix = compute_nav_prefix(html)
-    title = extract_title(html)
+    These depend only on nav_prefix and project_name, so they are built once
+    per output tree rather than once per file.
+
+    Returns:
+        Tuple of (navbar, navbar_template, index_heading, trace_heading), where
+        navbar_template contains _CONTENTS_PLACEHOLDER for the Contents items.
+    """
+    # build_navbar() does not render its title argument, so one navbar serves every page
+    navbar = build_navbar('', nav_prefix, False, None, project_name)
+    navbar_template = build_navbar('', nav_prefix, True, _CONTENTS_PLACEHOLDER, project_name)
 
-    # --- Heading text ---
     if project_name:
         index_heading = f'{project_name} Requirements'
         trace_heading = f'{project_name} Traceability Matrix'
@@ -169,113 +227,163 @@ def process_html(filepath, project_name=""):
         index_heading = 'Requirements'
         trace_heading = 'Traceability Matrix'
 
+    return navbar, navbar_template, index_heading, trace_heading
+
+
+def _make_contexts(project_name=""):
+    """Precompute contexts for both nav_prefix values (see compute_nav_prefix)."""
+    return {prefix: _make_context(prefix, project_name) for prefix in ('', '../')}
+
+
+def process_html(filepath, project_name="", contexts=None, kind=None):
+    """Process a single HTML file.
+
+    contexts is the result of _make_contexts(project_name); pass it when
+    processing many files to avoid rebuilding the navbars for each one.
+    kind is the page kind (see compute_page_kind). If omitted, it is derived
+    from the file name and whether the page's links point up a directory.
+    """
+    # Binary I/O skips the text layer's newline translation; output keeps the source line endings
+    path = Path(filepath)
+    orig_html = path.read_bytes().decode('utf-8')
+
+    if contexts is None:
+        contexts = _make_contexts(project_name)
+    nav_prefix = compute_nav_prefix(orig_html)
+    navbar, navbar_template, index_heading, trace_heading = contexts[nav_prefix]
+    if kind is None:
+        # Without the output root, a page's links tell whether it sits there
+        kind = compute_page_kind(os.path.basename(filepath)) if nav_prefix == '' else 'doc'
+
     # --- <head> replacements ---
 
     # Add lang to <html> (data-bs-theme set by dark mode JS in <head>)
-    html = re.sub(r'<html\b[^>]*>', '<html lang="en">', html)
-
-    # Add viewport meta if not present
-    if 'name="viewport"' not in html:
-        html = html.replace(
-            '<meta charset="utf-8" />',
-            '<meta charset="utf-8" />\n  <meta name="viewport" content="width=device-width, initial-scale=1">'
-        )
-
-    # Replace local Bootstrap CSS with CDN
-    html = re.sub(
-        r'<link[^>]*href="[^"]*bootstrap\.min\.css"[^>]*/?>',
-        BOOTSTRAP_CSS_CDN,
-        html
-    )
+    html = _RE_HTML_TAG.sub('<html lang="en">', orig_html)
+
+    # Add viewport meta if not present; only <head> can hold it
+    head_end = html.find('</head>')
+    if 'name="viewport"' not in (html[:head_end] if head_end != -1 else html):
+        html = html.replace('<meta charset="utf-8" />', '<meta charset="utf-8" />' + _VIEWPORT_META)
 
-    # Remove general.css and doorstop.css links, replace with inline styles
-    html = re.sub(r'<link[^>]*href="[^"]*general\.css"[^>]*/?>[\r\n]*', '', html)
-    html = re.sub(r'<link[^>]*href="[^"]*doorstop\.css"[^>]*/?>[\r\n]*', '', html)
+    # Replace local Bootstrap CSS with CDN, followed by inline CSS and dark mode JS
+    html = _RE_BOOTSTRAP_CSS.sub(_HEAD_INJECT, html)
 
-    # Insert inline CSS and dark mode JS after Bootstrap CDN link
-    # Dark mode JS must be in <head> to apply before first paint
-    html = html.replace(BOOTSTRAP_CSS_CDN, BOOTSTRAP_CSS_CDN + '\n  ' + INLINE_CSS + '\n  ' + DARK_MODE_JS)
+    # Remove general.css and doorstop.css links (replaced by the inline styles)
+    html = _RE_GENERAL_CSS.sub('', html)
+    html = _RE_DOORSTOP_CSS.sub('', html)
 
     # Remove MathJax script tags
-    html = re.sub(
-        r'<script[^>]*id="MathJax-script"[^>]*></script>[\r\n]*',
-        '',
-        html
-    )
-    html = re.sub(
-        r'<script type="text/x-mathjax-config">.*?</script>[\r\n]*',
-        '',
-        html,
-        flags=re.DOTALL
-    )
+    html = _RE_MATHJAX_SCRIPT.sub('', html)
+    html = _RE_MATHJAX_CONFIG.sub('', html)
 
     # --- Navbar replacement ---
 
-    # Extract Contents dropdown before replacing the header
-    contents_html = extract_contents_dropdown(html)
-    has_contents = contents_html is not None
-
-    # Replace entire <header>...</header> with branded navbar
-    new_navbar = build_navbar(title, nav_prefix, has_contents, contents_html, project_name)
-    html = re.sub(r'<header\b[^>]*>.*?</header>', new_navbar, html, flags=re.DOTALL)
+    # The single <header> sits near the top; bracket it with find() instead
+    # of a DOTALL regex over the whole document
+    i = html.find('<header')
+    j = html.find('</header>', i) if i != -1 else -1
+    if j != -1:
+        # Extract Contents dropdown before replacing the header
+        contents_html = extract_contents_dropdown(html[i:j + 9])
+        if contents_html:
+            new_navbar = navbar_template.replace(_CONTENTS_PLACEHOLDER, contents_html)
+        else:
+            new_navbar = navbar
+
+        # Replace entire <header>...</header> with branded navbar
+        html = html[:i] + new_navbar + html[j + 9:]
 
     # --- <body> accessibility ---
 
     # Add skip-nav link as first child of <body>
-    html = html.replace('<body>', '<body>\n' + SKIP_NAV_LINK)
+    html = _RE_BODY.sub(_BODY_INJECT, html)
 
     # Add id="main-content" to <main> element
-    html = re.sub(r'<main\b([^>]*)>', r'<main id="main-content"\1>', html)
+    html = _RE_MAIN.sub(r'<main id="main-content"\1>', html)
 
-    # --- Replace Doorstop headings ---
+    # --- Per-page headings and caption ---
 
-    html = html.replace('<H1>Doorstop index</H1>', f'<h1>{index_heading}</h1>')
-    html = html.replace(
-        '<H1>Doorstop traceability matrix</H1>',
-        f'<h1>{trace_heading}</h1>'
-    )
+    if kind == 'index':
+        html = html.replace('<H1>Doorstop index</H1>', f'<h1>{index_heading}</h1>')
+    elif kind == 'traceability':
+        html = html.replace('<H1>Doorstop traceability matrix</H1>', f'<h1>{trace_heading}</h1>')
+        html = _RE_TABLE_CAPTION.sub(_TABLE_CAPTION, html)
 
-    # --- Traceability table caption ---
+    # --- Replace local Bootstrap JS with CDN ---
 
-    # Add <caption> to the traceability table if present
-    html = re.sub(
-        r'(<table class="table">\s*<thead>)',
-        r'<table class="table">\n<caption>Requirements traceability matrix</caption>\n<thead>',
-        html
-    )
+    html = _RE_BOOTSTRAP_JS.sub(BOOTSTRAP_JS_CDN, html)
 
-    # --- Replace local Bootstrap JS with CDN ---
+    # Leave untouched files alone
+    if html != orig_html:
+        path.write_bytes(html.encode('utf-8'))
+
+
+def _scan_html_files(output_dir):
+    """Yield a DirEntry for every .html file in the output_dir tree.
+
+    Doorstop's template/ asset directory holds no pages and is not descended.
+    """
+    stack = [output_dir]
+    while stack:
+        with os.scandir(stack.pop()) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name != 'template':
+                        stack.append(entry.path)
+                elif entry.name.endswith('.html') and entry.is_file():
+                    yield entry
 
-    html = re.sub(
-        r'<script[^>]*src="[^"]*bootstrap\.bundle\.min\.js"[^>]*></script>',
-        BOOTSTRAP_JS_CDN,
-        html
-    )
 
-    with open(filepath, 'w', encoding='utf-8') as f:
-        f.write(html)
+def _is_up_to_date(entry):
+    """Return True if the file has not changed since it was last post-processed."""
+    try:
+        return os.path.getmtime(entry.path + STAMP_SUFFIX) >= entry.stat().st_mtime
+    except OSError:
+        return False
 
 
-def postprocess_directory(output_dir, project_name=""):
+def _touch_stamp(filepath):
+    """Mark filepath as post-processed."""
+    open(filepath + STAMP_SUFFIX, 'w').close()
+
+
+def postprocess_directory(output_dir, project_name="", force=False):
     """Post-process all HTML files in a directory tree.
 
+    Files whose stamp is newer than the file itself were already processed
+    and are skipped, so re-running on an unchanged tree does no work.
+    A forced run neither reads nor writes stamps, so it leaves no markers in
+    the output tree. Re-processing an already processed page is safe:
+    process_html recognises its own markup and leaves the file unchanged.
+
     Args:
         output_dir: Path to the directory containing Doorstop HTML output.
         project_name: Project name for branding (e.g., "ControlNav").
                       If empty, generic "Requirements" branding is used.
+        force: Process every file and write no stamps (for freshly generated
+               output that is deployed as-is).
 
     Returns:
         Number of files processed.
     """
+    # Serial on purpose: at ~20 ms per MB of HTML, a worker pool's ~0.1 s
+    # startup only pays off on trees far larger than Doorstop produces
+    contexts = _make_contexts(project_name)
     count = 0
-    for root, dirs, files in os.walk(output_dir):
-        for fname in files:
-            if fname.endswith('.html'):
-                filepath = os.path.join(root, fname)
-                print(f'  Processing: {os.path.relpath(filepath, output_dir)}')
-                process_html(filepath, project_name)
-                count += 1
-
+    skipped = 0
+    for entry in _scan_html_files(output_dir):
+        if not force and _is_up_to_date(entry):
+            skipped += 1
+            continue
+        relpath = os.path.relpath(entry.path, output_dir)
+        print(f'  Processing: {relpath}')
+        process_html(entry.path, project_name, contexts, compute_page_kind(relpath))
+        if not force:
+            _touch_stamp(entry.path)
+        count += 1
+
+    if skipped:
+        print(f'  Skipped {skipped} unchanged HTML file(s)')
     print(f'  Post-processed {count} HTML file(s)')
     return count
 
@@ -286,6 +394,7 @@ def main():
     )
     parser.add_argument('output_dir', help='Directory containing Doorstop HTML output')
     parser.add_argument('--project-name', default='', help='Project name for branding (e.g., "ControlNav")')
+    parser.add_argument('--force', action='store_true', help='Process every file and write no stamp markers')
 
     args = parser.parse_args()
 
@@ -293,7 +402,7 @@ def main():
         print(f'ERROR: Directory not found: {args.output_dir}')
         sys.exit(1)
 
-    postprocess_directory(args.output_dir, args.project_name)
+    postprocess_directory(args.output_dir, args.project_name, args.force)
 
 
 if __name__ == '__main__':
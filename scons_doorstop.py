@@ -12,12 +12,16 @@ Usage in SConstruct:
 """
 
 import os
+import re
 import shutil
 import subprocess
 import sys
 
 from postprocess_html import postprocess_directory
 
+# `prefix:` setting in .doorstop.yml (nested under `settings:`, so indented)
+_RE_PREFIX = re.compile(rb'^[ \t]*prefix:[ \t]*["\']?([^"\'\s][^"\'\r\n]*)', re.MULTILINE)
+
 
 def _discover_documents(reqs_dir):
     """Auto-discover Doorstop document directories from .doorstop.yml files.
@@ -34,13 +38,13 @@ def _discover_documents(reqs_dir):
         if os.path.isdir(entry_path) and os.path.exists(doorstop_yml):
             # Read the prefix from .doorstop.yml
             prefix = entry.upper()
+            # Settings come first in the file, so the head is enough
             try:
-                with open(doorstop_yml, 'r', encoding='utf-8') as f:
-                    for line in f:
-                        line = line.strip()
-                        if line.startswith('prefix:'):
-                            prefix = line.split(':', 1)[1].strip().strip('"').strip("'")
-                            break
+                with open(doorstop_yml, 'rb') as f:
+                    head = f.read(2048)
+                m = _RE_PREFIX.search(head)
+                if m:
+                    prefix = m.group(1).decode('utf-8').strip()
             except (OSError, UnicodeDecodeError):
                 pass
             documents[entry] = prefix
@@ -48,6 +52,24 @@ def _discover_documents(reqs_dir):
     return documents
 
 
+def _scan_tree(root):
+    """Yield (dir_path, entries) for every directory under root, root first.
+
+    A scandir-based os.walk(): the DirEntry objects carry file type (and on
+    Windows, stat) information from the directory listing itself.
+    """
+    stack = [root]
+    while stack:
+        dir_path = stack.pop()
+        with os.scandir(dir_path) as it:
+            entries = list(it)
+        yield dir_path, entries
+        stack.extend(
+            e.path for e in sorted(entries, key=lambda e: e.name, reverse=True)
+            if e.is_dir(follow_symlinks=False)
+        )
+
+
 def _install_deps(target, source, env):
     """Install requirements management dependencies (doorstop)."""
     print("\nInstalling requirements management dependencies...")
@@ -78,18 +100,19 @@ def _make_validate_action(project_root, config):
             print(f"ERROR: {reqs_dir_name}/ directory not found.")
             return 1
 
+        # Keep output as bytes; only stdout and the reported stderr lines are decoded
         cmd = ['doorstop']
-        result = subprocess.run(cmd, cwd=project_root, capture_output=True, text=True)
+        result = subprocess.run(cmd, cwd=project_root, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
         if result.stdout:
-            print(result.stdout)
+            print(result.stdout.decode('utf-8', errors='replace'))
 
         if result.stderr:
             for line in result.stderr.splitlines():
-                if 'ERROR' in line:
-                    print(f"  ERROR: {line}")
-                elif 'WARNING' in line:
-                    print(f"  {line}")
+                if b'ERROR' in line:
+                    print(f"  ERROR: {line.decode('utf-8', errors='replace')}")
+                elif b'WARNING' in line:
+                    print(f"  {line.decode('utf-8', errors='replace')}")
 
         # Resolve documents (auto-discover if not provided)
         docs = documents if documents else _discover_documents(reqs_dir)
@@ -100,14 +123,18 @@ def _make_validate_action(project_root, config):
         for dirname, prefix in sorted(docs.items()):
             doc_path = os.path.join(reqs_dir, dirname)
             if os.path.isdir(doc_path):
-                count = len([f for f in os.listdir(doc_path) if f.endswith('.yml') and not f.startswith('.')])
+                with os.scandir(doc_path) as it:
+                    count = sum(
+                        1 for e in it
+                        if e.name.endswith('.yml') and not e.name.startswith('.') and e.is_file()
+                    )
                 counts[prefix] = count
                 total += count
 
         counts_str = ', '.join(f'{prefix}={count}' for prefix, count in counts.items())
         print(f"\nItem counts: {counts_str}, Total={total}")
 
-        has_errors = 'ERROR' in (result.stderr or '')
+        has_errors = b'ERROR' in result.stderr
         if has_errors:
             print("\nValidation FAILED with errors.")
             return 1
@@ -143,25 +170,28 @@ def _make_publish_action(project_root, config):
             print("\nPublishing failed.")
             return result.returncode
 
-        # Post-process HTML files (CDN, dark mode, accessibility, branding)
-        print("\nPost-processing HTML files...")
-        postprocess_directory(output_dir, project_name)
-
-        # Remove template/ directory (assets now loaded from CDN)
+        # Remove template/ directory (assets are loaded from CDN after
+        # post-processing) before walking the output tree
         template_dir = os.path.join(output_dir, 'template')
         if os.path.exists(template_dir):
             shutil.rmtree(template_dir)
             print("  Removed template/ directory (using CDN)")
 
+        # Post-process HTML files (CDN, dark mode, accessibility, branding).
+        # The output tree was just regenerated, so publish does not use the
+        # stamp skip; force also keeps stamp files out of the published tree.
+        print("\nPost-processing HTML files...")
+        postprocess_directory(output_dir, project_name, force=True)
+
         # List output files
         print(f"\nRequirements published to: {output_dir}")
-        for root, dirs, files in os.walk(output_dir):
-            for f in sorted(files):
-                if f.endswith(('.html', '.csv')):
-                    fpath = os.path.join(root, f)
-                    relpath = os.path.relpath(fpath, output_dir)
-                    size = os.path.getsize(fpath) / 1024
-                    print(f"  {relpath} ({size:.1f} KB)")
+        for dir_path, entries in _scan_tree(output_dir):
+            listed = [e for e in entries if e.name.endswith(('.html', '.csv')) and e.is_file()]
+            listed.sort(key=lambda e: e.name)
+            for entry in listed:
+                relpath = os.path.relpath(entry.path, output_dir)
+                size = entry.stat().st_size / 1024
+                print(f"  {relpath} ({size:.1f} KB)")
 
         return 0
 